@@ -8,6 +8,16 @@ import cv2
 import pyrealsense2 as rs
 import numpy as np
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# PyTurboJPEG (基于SIMD加速的libjpeg-turbo) 为可选依赖: pip install PyTurboJPEG
+# 未安装或找不到libturbojpeg动态库时回退到 cv2.imwrite
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+    turbo_jpeg = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
 
 # --- 配置参数 ---
 SAVE_PATH = "fruit_dataset/images"
@@ -15,6 +25,54 @@ IMG_WIDTH = 640
 IMG_HEIGHT = 480
 FPS = 30
 WINDOW_NAME = 'Realsense - 数据收集'
+# 录像保存路径 (按 'r' 键开始/停止录像)
+VIDEO_PATH = "fruit_dataset/videos"
+# JPEG保存质量 (0~100)。85 在画质和编码速度/文件大小之间较为均衡
+JPEG_QUALITY = 85
+
+def save_jpeg(filename, image):
+    """
+    将BGR图像编码为JPEG并写入磁盘，优先使用 turbojpeg。
+    在写盘线程中执行，写入完成后才打印保存结果，失败时打印错误信息。
+    """
+    try:
+        if turbo_jpeg is not None:
+            with open(filename, 'wb') as f:
+                f.write(turbo_jpeg.encode(image, quality=JPEG_QUALITY, pixel_format=TJPF_BGR))
+        # cv2.imwrite 失败时只返回 False 而不抛异常
+        elif not cv2.imwrite(filename, image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                                cv2.IMWRITE_JPEG_OPTIMIZE, 0]):
+            print(f"错误: 图像保存失败 (无法写入文件): {filename}")
+            return
+        print(f"已保存: {filename}")
+    except Exception as e:
+        print(f"错误: 图像保存失败: {filename}。{e}")
+
+def open_video_writer():
+    """
+    创建MP4视频写入器。优先使用H.264(avc1)并请求硬件编码，
+    当前OpenCV构建不支持时依次回退到软件H.264和MPEG-4(mp4v)。
+    """
+    if not os.path.exists(VIDEO_PATH):
+        os.makedirs(VIDEO_PATH)
+    filename = os.path.join(VIDEO_PATH, f"capture_{time.strftime('%Y%m%d-%H%M%S')}.mp4")
+    for codec, hw_accel in (('avc1', True), ('avc1', False), ('mp4v', False)):
+        fourcc = cv2.VideoWriter_fourcc(*codec)
+        try:
+            if hw_accel:
+                video = cv2.VideoWriter(filename, cv2.CAP_FFMPEG, fourcc, FPS, (IMG_WIDTH, IMG_HEIGHT),
+                                        [cv2.VIDEOWRITER_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+            else:
+                video = cv2.VideoWriter(filename, fourcc, FPS, (IMG_WIDTH, IMG_HEIGHT))
+        except (AttributeError, cv2.error):
+            # 旧版OpenCV没有硬件加速相关的参数
+            continue
+        if video.isOpened():
+            print(f"开始录像: {filename} (编码: {codec}{', 硬件加速' if hw_accel else ''})")
+            return video, filename
+        video.release()
+    print("错误: 无法创建视频文件，请检查OpenCV是否带有FFmpeg支持。")
+    return None, None
 
 def main():
     # --- 1. 准备工作 ---
@@ -28,6 +86,9 @@ def main():
 
     # --- 3. 初始化并启动 Realsense ---
     pipeline = None
+    video = None
+    # 图片的编码和写盘在后台线程中完成，采集循环不会因保存而卡顿
+    writer = ThreadPoolExecutor(max_workers=1)
     try:
         print("初始化Realsense Pipeline...")
         pipeline = rs.pipeline()
@@ -44,6 +105,7 @@ def main():
         print("操作指南:")
         print("  - 窗口现在应该已显示，请将水果置于镜头前。")
         print("  - 按 's' 键保存当前画面。")
+        print("  - 按 'r' 键开始/停止录像 (录像可在之后按固定间隔抽帧用于标注)。")
         print("  - 按 'q' 键 或 点击窗口的'X'按钮 退出程序。")
         print("="*50 + "\n")
 
@@ -61,8 +123,17 @@ def main():
             if color_image.size == 0:
                 continue
 
+            if video is not None:
+                video.write(color_image)
+                # 录像时在预览画面(副本)上显示录制标记，不影响保存的图像
+                preview = color_image.copy()
+                cv2.circle(preview, (20, 20), 8, (0, 0, 255), -1)
+                cv2.putText(preview, "REC", (35, 27), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+            else:
+                preview = color_image
+
             # 在预先创建的窗口中显示图像
-            cv2.imshow(WINDOW_NAME, color_image)
+            cv2.imshow(WINDOW_NAME, preview)
             key = cv2.waitKey(1) & 0xFF
 
             if key == ord('q'):
@@ -70,9 +141,18 @@ def main():
                 break
             elif key == ord('s'):
                 img_name = os.path.join(SAVE_PATH, f"fruit_{img_counter:04d}.jpg")
-                cv2.imwrite(img_name, color_image)
-                print(f"已保存: {img_name}")
+                # 保存结果由写盘线程在写入完成后打印
+                writer.submit(save_jpeg, img_name, color_image)
                 img_counter += 1
+            elif key == ord('r'):
+                if video is None:
+                    video, video_name = open_video_writer()
+                else:
+                    video.release()
+                    video = None
+                    print(f"录像已保存: {video_name}")
+                    print(f"  可用以下命令每秒抽取2帧用于标注: "
+                          f"ffmpeg -i {video_name} -vf fps=2 fruit_%04d.jpg")
         
         print("窗口已关闭。")
 
@@ -82,6 +162,10 @@ def main():
 
     finally:
         # --- 5. 清理资源 ---
+        # 等待尚未写完的图片全部保存到磁盘
+        writer.shutdown(wait=True)
+        if video is not None:
+            video.release()
         if pipeline:
             print("正在关闭摄像头...")
             pipeline.stop()
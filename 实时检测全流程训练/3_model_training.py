@@ -4,7 +4,7 @@
 
 功能:
 - [新] 自动检测并读取 'fruit_dataset/labels/classes.txt' 文件来获取类别列表。
-- 自动创建YOLOv8训练所需的 `data.yaml` 配置文件。
+- 自动创建YOLOv8训练所需的数据集配置文件。
 - 加载预训练的YOLOv8n模型。
 - 使用您自定义的数据集进行训练。
 
@@ -12,19 +12,36 @@
 1. 确保已完成数据收集和标注，并已将数据集划分为 train/val 两个部分。
 2. 确保 `labelImg` 生成的 `classes.txt` 文件位于 `fruit_dataset/labels/` 文件夹中。
 3. 运行此脚本开始训练。
+   数据集配置文件保存为 `fruit_dataset/.data-<内容哈希>.yaml` (以点开头，默认隐藏)，
+   类别或路径不变时直接复用；类别变化后会生成新的文件。
 """
 import os
+import hashlib
 import yaml
+
+# 减少训练时CUDA显存碎片，需在导入 torch/ultralytics 之前设置
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'expandable_segments:True')
+
 from ultralytics import YOLO
 
 # --- 1. 配置参数 ---
 
 # 数据集根目录
 DATASET_DIR = 'fruit_dataset'
+# 数据集绝对路径 (导入时计算一次)
+DATASET_ABS_PATH = os.path.abspath(DATASET_DIR)
 # 训练轮次
 EPOCHS = 30
 # 预训练模型
 MODEL_NAME = 'yolov8n.pt' 
+# 数据加载进程数：并行完成JPEG解码和数据增强，避免GPU等待数据
+WORKERS = min(os.cpu_count() or 1, 12)
+# 解码后的图像总量低于此值 (GB) 时缓存到内存，否则缓存到磁盘
+RAM_CACHE_LIMIT_GB = 4
+# 训练后导出 INT8 TensorRT 引擎。若 INT8 引擎的 mAP50-95 比原始权重下降超过此值，改为导出 FP16 引擎
+INT8_MAX_MAP_DROP = 0.01
+# 引擎的最大批大小 (动态批)，需与 4_realtime_detection.py 中的 BATCH 一致
+ENGINE_BATCH = 4
 
 def get_class_names():
     """
@@ -56,10 +73,10 @@ def get_class_names():
     return fallback_class_names
 
 def create_yaml_file(class_names):
-    """自动创建 data.yaml 配置文件"""
+    """自动创建数据集配置文件 (.data-<内容哈希>.yaml)"""
     
     if not class_names:
-        print("错误: 类别列表为空，无法创建 data.yaml。")
+        print("错误: 类别列表为空，无法创建数据集配置文件。")
         return False
         
     # 检查数据集路径是否存在
@@ -67,33 +84,83 @@ def create_yaml_file(class_names):
         print(f"错误: 数据集文件夹 '{DATASET_DIR}' 不存在。")
         return False
         
-    print("正在创建 data.yaml 配置文件...")
-    
-    try:
-        dataset_abs_path = os.path.abspath(DATASET_DIR)
-    except Exception as e:
-        print(f"获取绝对路径时出错: {e}")
-        return False
-
     # 创建YAML文件内容
     yaml_content = {
-        'train': os.path.join(dataset_abs_path, 'images/train/'),
-        'val': os.path.join(dataset_abs_path, 'images/val/'),
+        'train': os.path.join(DATASET_ABS_PATH, 'images/train/'),
+        'val': os.path.join(DATASET_ABS_PATH, 'images/val/'),
         'nc': len(class_names),
         'names': class_names
     }
 
-    # 写入文件
-    yaml_file_path = os.path.join(DATASET_DIR, 'data.yaml')
+    # 按内容哈希命名配置文件，内容相同 (如多次训练、超参数搜索) 时直接复用已有文件
+    key = hashlib.md5(repr(yaml_content).encode('utf-8')).hexdigest()
+    yaml_file_path = os.path.join(DATASET_DIR, f'.data-{key}.yaml')
+    if os.path.exists(yaml_file_path):
+        print(f"复用已有的数据集配置文件: {yaml_file_path}")
+        return yaml_file_path
+
+    # 先写入临时文件再原子地替换到目标路径，写入中断时不会留下残缺的配置文件被后续复用
+    print(f"正在创建数据集配置文件: {yaml_file_path}")
+    tmp_file_path = f"{yaml_file_path}.{os.getpid()}.tmp"
     try:
-        with open(yaml_file_path, 'w', encoding='utf-8') as f:
+        with open(tmp_file_path, 'w', encoding='utf-8') as f:
             yaml.dump(yaml_content, f, default_flow_style=False, sort_keys=False, allow_unicode=True)
-        print(f"data.yaml 已成功创建在: {yaml_file_path}")
+        os.replace(tmp_file_path, yaml_file_path)
+        print(f"数据集配置文件已成功创建在: {yaml_file_path}")
         return yaml_file_path
     except Exception as e:
-        print(f"写入 data.yaml 文件时出错: {e}")
+        print(f"写入数据集配置文件 {yaml_file_path} 时出错: {e}")
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
         return False
 
+def choose_cache_mode():
+    """
+    根据数据集大小选择图像缓存方式。
+    按每张图像缩放到640后约 640x480x3 字节估算解码后的总大小。
+    """
+    num_images = 0
+    for split in ('train', 'val'):
+        split_dir = os.path.join(DATASET_DIR, 'images', split)
+        if os.path.isdir(split_dir):
+            num_images += len(os.listdir(split_dir))
+    estimated_gb = num_images * 640 * 480 * 3 / 1024 ** 3
+    return 'ram' if estimated_gb < RAM_CACHE_LIMIT_GB else 'disk'
+
+def export_engine(best_pt, yaml_path):
+    """
+    将训练好的权重导出为 TensorRT INT8 引擎 (使用数据集配置文件中的 val 集做量化校准)，
+    并在验证集上对比 mAP；精度下降过多时回退为 FP16 引擎。
+    引擎与 best.pt 保存在同一目录 (best.engine)，检测脚本会优先加载它。
+    """
+    print("\n正在导出 TensorRT INT8 引擎...")
+    try:
+        # 引擎在验证时不使用矩形(rect)批次，原始权重也按相同方式验证，保证 mAP 可比
+        baseline_map = YOLO(best_pt).val(data=yaml_path, imgsz=640, device=0, rect=False,
+                                         verbose=False).box.map
+        # 删除上次训练留下的INT8校准缓存 (best.cache)，否则TensorRT会直接复用旧权重的校准结果
+        calibration_cache = os.path.splitext(best_pt)[0] + '.cache'
+        if os.path.exists(calibration_cache):
+            os.remove(calibration_cache)
+        engine_path = YOLO(best_pt).export(format='engine', imgsz=640, int8=True, data=yaml_path,
+                                           dynamic=True, batch=ENGINE_BATCH, device=0, workspace=4)
+        int8_map = YOLO(engine_path, task='detect').val(data=yaml_path, imgsz=640, device=0,
+                                                       verbose=False).box.map
+        print(f"mAP50-95: 原始权重 {baseline_map:.4f}, INT8 引擎 {int8_map:.4f}")
+        if baseline_map - int8_map <= INT8_MAX_MAP_DROP:
+            print(f"INT8 引擎已保存: {engine_path}")
+            return engine_path
+
+        # FP16 引擎写入同一个 best.engine 文件，覆盖精度不达标的 INT8 引擎
+        print("INT8 量化后精度下降过多，改为导出 FP16 引擎...")
+        engine_path = YOLO(best_pt).export(format='engine', imgsz=640, half=True,
+                                           dynamic=True, batch=ENGINE_BATCH, device=0, workspace=4)
+        print(f"FP16 引擎已保存: {engine_path}")
+        return engine_path
+    except Exception as e:
+        print(f"导出 TensorRT 引擎失败，检测脚本将直接使用 best.pt。{e}")
+        return None
+
 def main():
     # --- 2. 自动获取类别并创建配置文件 ---
     class_names_list = get_class_names()
@@ -113,17 +180,32 @@ def main():
     print(f"  - 数据集配置: {yaml_path}")
     print(f"  - 训练轮次 (Epochs): {EPOCHS}")
     print(f"  - 图像尺寸 (Image Size): 640")
+    cache_mode = choose_cache_mode()
+    print(f"  - 数据加载进程数 (Workers): {WORKERS}")
+    print(f"  - 图像缓存 (Cache): {cache_mode}")
     print("="*50 + "\n")
 
     try:
         # 使用数据集训练模型
-        results = model.train(data=yaml_path, epochs=EPOCHS, imgsz=640, device=0) # device=0 使用GPU
+        # ultralytics 的数据加载器会在各轮之间复用工作进程，并默认使用页锁定内存；
+        # 验证集默认按矩形(rect)批次推理，训练集保持随机打乱，因此不单独开启 rect
+        results = model.train(
+            data=yaml_path, epochs=EPOCHS, imgsz=640,
+            device=0,           # device=0 使用GPU
+            batch=-1,           # 根据显存自动选择最大批大小
+            workers=WORKERS,
+            cache=cache_mode,
+            amp=True,           # 混合精度(FP16)训练
+        )
 
         print("\n" + "*"*50)
         print("训练完成！")
         print(f"最优模型已保存在最新的 '{results.save_dir}/weights/best.pt' 文件中。")
         print("*"*50)
 
+        # --- 5. 导出部署用的 TensorRT 引擎 ---
+        export_engine(os.path.join(results.save_dir, 'weights', 'best.pt'), yaml_path)
+
     except Exception as e:
         print(f"\n训练过程中发生错误: {e}")
         print("请检查：")
@@ -16,8 +16,14 @@
 import pyrealsense2 as rs
 import numpy as np
 import cv2
+import torch
 from ultralytics import YOLO
 import os
+import time
+import queue
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. 配置参数 ---
 # 图像尺寸
@@ -32,6 +38,226 @@ MODEL_PATH = os.path.join('runs', 'detect', 'train', 'weights', 'best.pt')
 
 # 如果您只是想测试摄像头和YOLOv8，可以使用预训练模型
 # MODEL_PATH = 'yolov8n.pt'  
+# TensorRT 引擎路径 (首次运行时由 MODEL_PATH 自动导出，支持动态批大小)
+ENGINE_PATH = os.path.splitext(MODEL_PATH)[0] + '.engine'
+# 推理输入尺寸
+INFER_SIZE = 640
+# 每次推理打包的帧数。越大吞吐越高，但每帧的显示延迟也越大，建议 2~4
+BATCH = 4
+# 显示队列容量：推理一次交回 BATCH 帧，多留一批的余量吸收推理耗时的抖动。
+# 队列中存放的是采集线程复制出的图像，不占用librealsense每个数据流16帧的缓冲上限；
+# 容量只决定显示跟不上时的最大延迟 (约 DISPLAY_QUEUE_SIZE / FPS 秒)
+DISPLAY_QUEUE_SIZE = 2 * BATCH
+# 预热推理次数：在进入主循环前完成cuDNN算法选择等一次性开销
+WARMUP_RUNS = 3
+# 显示窗口名称
+WINDOW_NAME = "YOLOv8 Real-Time Detection (Debug Mode)"
+
+class FrameProducer:
+    """
+    后台采集线程：持续从Realsense获取彩色帧并放入容量为2的队列，使采集与GPU推理并行。
+    队列满时丢弃最旧的一帧，主线程总是处理最新画面。
+    """
+    def __init__(self, pipeline, maxsize=2):
+        self.pipeline = pipeline
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动采集线程"""
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                frames = self.pipeline.wait_for_frames()
+            except RuntimeError as e:
+                print(f"获取帧时发生错误: {e}")
+                continue
+            color_frame = frames.get_color_frame()
+            if not color_frame:
+                continue
+            # 复制一份自有的图像后立即释放SDK帧。帧缓冲区的数组视图会让SDK帧一直存活，
+            # 而本脚本中图像会在采集队列、推理批次和显示队列中停留十几帧之久，
+            # 超过librealsense每个数据流默认16帧的上限后SDK会丢帧甚至使 wait_for_frames 超时。
+            # 检测框直接绘制在这份副本上
+            color_image = np.frombuffer(color_frame.get_data(), np.uint8).reshape(
+                IMG_HEIGHT, IMG_WIDTH, 3).copy()
+            # 队列已满时先丢弃最旧的一帧
+            if self.frames.full():
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+            self.frames.put(color_image, block=True)
+
+    def get(self, timeout=1.0):
+        """取出一帧彩色图像，超时返回 None"""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self):
+        """通知采集线程退出并等待其结束"""
+        self.stop_event.set()
+        self.thread.join(timeout=6.0)
+
+class DisplayWorker:
+    """
+    显示线程：在独立线程中执行 imshow/waitKey，使推理循环不再等待窗口刷新；
+    截图的JPEG编码与写盘交给单线程线程池完成。
+    批量推理一次交回 BATCH 帧，这些帧先进入一个小的先进先出队列，再按采集帧率逐帧显示，
+    画面保持 FPS 的刷新率而不是每批只显示最后一帧。
+    """
+    def __init__(self, window_name, maxlen=DISPLAY_QUEUE_SIZE, interval=1.0 / FPS):
+        self.window_name = window_name
+        # 显示跟不上时丢弃最旧的帧，延迟不会无限增长
+        self.frames = collections.deque(maxlen=maxlen)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.keys = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        """启动显示线程"""
+        self.thread.start()
+
+    def _run(self):
+        # 窗口的创建、刷新和销毁都在同一线程中完成
+        cv2.namedWindow(self.window_name, cv2.WINDOW_AUTOSIZE)
+        next_show = time.monotonic()
+        while not self.stop_event.is_set():
+            frame = None
+            now = time.monotonic()
+            if now >= next_show:
+                with self.lock:
+                    if self.frames:
+                        frame = self.frames.popleft()
+            if frame is not None:
+                cv2.imshow(self.window_name, frame)
+                # 连续显示时按固定节拍推进，避免累积漂移；空闲一段时间后从当前时刻重新计时
+                if now - next_show >= self.interval:
+                    next_show = now
+                next_show += self.interval
+            key = cv2.waitKey(1) & 0xFF
+            if key != 0xFF:
+                self.keys.put(key)
+        cv2.destroyAllWindows()
+
+    def show(self, frame):
+        """提交一帧待显示的图像，按提交顺序排队显示"""
+        with self.lock:
+            self.frames.append(frame)
+
+    def poll_key(self):
+        """非阻塞地取出一个按键，没有按键时返回 -1"""
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return -1
+
+    def save(self, filename, frame):
+        """在后台线程中编码并保存图像 (调用方之后不应再修改 frame)"""
+        self.writer.submit(self._write, filename, frame)
+
+    @staticmethod
+    def _write(filename, frame):
+        # 在写盘线程中执行，写入完成后才报告结果；cv2.imwrite 失败时只返回 False 而不抛异常
+        try:
+            if cv2.imwrite(filename, frame):
+                print(f"截图已保存至: {filename}")
+            else:
+                print(f"错误: 截图保存失败 (无法写入文件): {filename}")
+        except Exception as e:
+            print(f"错误: 截图保存失败: {filename}。{e}")
+
+    def stop(self):
+        """关闭窗口并等待所有截图写入完成"""
+        self.stop_event.set()
+        self.thread.join(timeout=1.0)
+        self.writer.shutdown(wait=True)
+
+def build_class_styles(names):
+    """
+    在模型加载后预先生成类别名称列表和每个类别的BGR颜色，
+    绘制时按类别ID直接查表，避免每帧重复查找和计算。
+    """
+    class_names = list(names.values())
+    # 在HSV空间按类别均匀取色 (OpenCV的H范围为0~179)，再一次性转换为BGR
+    hsv = np.array([[(h * 40 % 180, 200, 200) for h in range(len(class_names))]], np.uint8)
+    bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0]
+    class_colors = [tuple(int(c) for c in color) for color in bgr]
+    return class_names, class_colors
+
+def render_sprite(text, color, height):
+    """把一段文字渲染成黑底的小图块 (仅在启动时调用)"""
+    (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    sprite = np.zeros((height, w + 4, 3), np.uint8)
+    cv2.putText(sprite, text, (2, height - baseline - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return sprite
+
+def build_label_sprites(class_names, class_colors):
+    """
+    预先渲染标签图块：每个类别名称一块 (类别颜色)，置信度 0.00~1.00 共101块 (白色)。
+    绘制时只需把图块拷贝到画面上，不再每帧调用 putText 逐笔光栅化字形。
+    """
+    (_, h), baseline = cv2.getTextSize("0123456789Agjy", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    height = h + baseline + 4
+    name_sprites = [render_sprite(name, color, height)
+                    for name, color in zip(class_names, class_colors)]
+    conf_sprites = [render_sprite(" %.2f" % (i / 100), (255, 255, 255), height) for i in range(101)]
+    return name_sprites, conf_sprites
+
+def blit_sprite(image, sprite, x, y):
+    """将图块的左下角对齐到 (x, y) 拷贝到画面上，超出画面的部分被裁掉；返回图块右边缘的x坐标"""
+    h, w = sprite.shape[:2]
+    img_h, img_w = image.shape[:2]
+    # 框贴近画面顶部时，把标签放到框内
+    top = max(y - h, 0)
+    left, right = max(x, 0), min(x + w, img_w)
+    bottom = min(top + h, img_h)
+    if left < right and top < bottom:
+        image[top:bottom, left:right] = sprite[:bottom - top, left - x:right - x]
+    return x + w
+
+def draw_label(image, x, y, name_sprite, conf_sprites, conf):
+    """在 (x, y) 上方绘制 '类别 置信度' 标签"""
+    x = blit_sprite(image, name_sprite, x, y)
+    blit_sprite(image, conf_sprites[min(int(conf * 100 + 0.5), 100)], x, y)
+
+def draw_detections(image, xyxy, confs, cls_ids, class_colors, name_sprites, conf_sprites):
+    """直接在原图上绘制检测框和 '类别 置信度' 标签 (原地修改，不复制图像)"""
+    # tolist() 转为Python整数，兼容要求原生int坐标的OpenCV版本
+    for (x1, y1, x2, y2), conf, cls_id in zip(xyxy.tolist(), confs, cls_ids):
+        cv2.rectangle(image, (x1, y1), (x2, y2), class_colors[cls_id], 2)
+        draw_label(image, x1, y1, name_sprites[cls_id], conf_sprites, conf)
+
+def load_model():
+    """
+    加载YOLOv8模型，优先使用TensorRT FP16引擎。
+    引擎以动态批大小 (最大 BATCH) 导出，使TensorRT按真实的批形状选择内核；
+    引擎不存在或比 MODEL_PATH 旧时重新导出，导出失败则回退到PyTorch模型。
+    """
+    # 权重在引擎导出之后被重新训练或替换过 (修改时间更新) 时，旧引擎已过期，需要重新导出
+    engine_stale = (os.path.exists(ENGINE_PATH) and os.path.exists(MODEL_PATH)
+                    and os.path.getmtime(MODEL_PATH) > os.path.getmtime(ENGINE_PATH))
+    if engine_stale or not os.path.exists(ENGINE_PATH):
+        if engine_stale:
+            print(f"模型权重 '{MODEL_PATH}' 比TensorRT引擎新，正在重新导出 FP16 引擎...")
+        else:
+            print(f"未找到TensorRT引擎，正在从 '{MODEL_PATH}' 导出 FP16 引擎 (仅首次运行需要)...")
+        try:
+            YOLO(MODEL_PATH).export(format="engine", imgsz=INFER_SIZE, half=True,
+                                    dynamic=True, batch=BATCH, device=0)
+        except Exception as e:
+            print(f"警告: TensorRT引擎导出失败，将使用PyTorch模型推理。{e}")
+            return YOLO(MODEL_PATH)
+    print(f"正在加载TensorRT引擎: {ENGINE_PATH}")
+    return YOLO(ENGINE_PATH, task='detect')
 
 def main():
     # --- 2. 加载自定义YOLOv8模型 ---
@@ -42,10 +268,19 @@ def main():
         return
         
     try:
-        model = YOLO(MODEL_PATH)
+        model = load_model()
         print("模型加载成功！")
         # 打印模型识别的类别
         print(f"模型可识别的类别: {model.names}")
+        class_names, class_colors = build_class_styles(model.names)
+        name_sprites, conf_sprites = build_label_sprites(class_names, class_colors)
+        # 输入尺寸固定，让cuDNN为每个卷积自动选择最快的算法
+        torch.backends.cudnn.benchmark = True
+        # 用与主循环相同批大小的空白图像预热，使第一批的延迟即为稳定状态的延迟
+        print("正在预热模型...")
+        dummy_batch = [np.zeros((IMG_HEIGHT, IMG_WIDTH, 3), np.uint8)] * BATCH
+        for _ in range(WARMUP_RUNS):
+            model(dummy_batch, conf=CONFIDENCE_THRESHOLD, imgsz=INFER_SIZE, verbose=False)
     except Exception as e:
         print(f"错误: 加载模型失败。{e}")
         return
@@ -63,53 +298,68 @@ def main():
         print(f"错误：无法启动Realsense摄像头。{e}")
         return
 
+    # 采集线程与推理线程已并行，限制OpenCV内部线程数以避免CPU过度订阅
+    cv2.setNumThreads(1)
+    producer = FrameProducer(pipeline)
+    producer.start()
+    display = DisplayWorker(WINDOW_NAME)
+    display.start()
+
     # --- 4. 主循环：实时检测 ---
     print("\n实时检测已启动，按 'q' 键退出。")
     try:
+        batch = []
         while True:
-            # 等待一帧数据
-            frames = pipeline.wait_for_frames()
-            color_frame = frames.get_color_frame()
-            if not color_frame:
+            # 从采集线程获取最新的一帧
+            color_image = producer.get()
+            if color_image is None:
                 continue
 
-            # 将帧数据转换为numpy数组
-            color_image = np.asanyarray(color_frame.get_data())
-
-            # --- [!!] YOLOv8 推理，并传入置信度阈值 ---
-            results = model(color_image, conf=CONFIDENCE_THRESHOLD, verbose=False)
-
-            # --- [!!] 调试代码，检查并打印检测结果 ---
-            boxes = results[0].boxes
-            # 打印当前帧找到的物体数量
-            print(f"当前帧找到 {len(boxes)} 个物体。")
-            # 如果找到了物体，打印它们的详细信息
-            if len(boxes) > 0:
-                for box in boxes:
-                    # 获取类别ID和置信度
-                    try:
-                        cls_id = int(box.cls[0])
-                        confidence = float(box.conf[0])
-                        print(f"  -> 类别: {model.names[cls_id]}, 置信度: {confidence:.2f}")
-                    except IndexError:
-                        print("  -> 无法解析某个检测框的信息。")
-
-            # --- 可视化结果 ---
-            # results[0].plot() 会自动使用传入的conf阈值来绘制图像
-            annotated_frame = results[0].plot()
-
-            # 在窗口中显示带有检测结果的图像
-            cv2.imshow("YOLOv8 Real-Time Detection (Debug Mode)", annotated_frame)
-
-            # 按 'q' 键退出
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+            # 攒够 BATCH 帧后再一次性推理，摊薄每次调用的Python/CUDA启动开销
+            batch.append(color_image)
+            if len(batch) < BATCH:
+                continue
+
+            # --- [!!] YOLOv8 批量推理，并传入置信度阈值 ---
+            results = model(batch, conf=CONFIDENCE_THRESHOLD, imgsz=INFER_SIZE, verbose=False)
+
+            # 按原始顺序逐帧处理推理结果
+            quit_requested = False
+            for color_image, result in zip(batch, results):
+                # 一次性取出本帧所有检测框的坐标、置信度和类别
+                boxes = result.boxes
+                xyxy = boxes.xyxy.cpu().numpy().astype(np.int32)
+                confs = boxes.conf.cpu().numpy()
+                cls_ids = boxes.cls.cpu().numpy().astype(np.int32)
+
+                # --- [!!] 调试代码，打印当前帧找到的物体数量及详细信息 ---
+                print(f"当前帧找到 {len(xyxy)} 个物体。")
+                for conf, cls_id in zip(confs, cls_ids):
+                    print(f"  -> 类别: {class_names[cls_id]}, 置信度: {conf:.2f}")
+
+                # --- 可视化结果 ---
+                # 直接在原图上绘制，省去 result.plot() 的整帧复制和标签排版开销
+                draw_detections(color_image, xyxy, confs, cls_ids, class_colors,
+                                name_sprites, conf_sprites)
+
+                # 交给显示线程显示带有检测结果的图像
+                display.show(color_image)
+
+                # 按 'q' 键退出
+                if display.poll_key() == ord('q'):
+                    quit_requested = True
+                    break
+
+            batch = []
+            if quit_requested:
                 break
 
     finally:
         # --- 5. 停止摄像头并关闭窗口 ---
         print("正在关闭摄像头...")
+        producer.stop()
+        display.stop()
         pipeline.stop()
-        cv2.destroyAllWindows()
         print("程序已成功关闭。")
 
 if __name__ == '__main__':
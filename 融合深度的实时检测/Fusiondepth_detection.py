@@ -6,7 +6,7 @@
 - 继承项目一的所有功能（加载YOLOv8模型，实时检测物体）。
 - **功能**:
   - 对每一个检测到的物体，计算其边界框的中心点。
-  - 利用Realsense的对齐深度帧，精确获取该中心点的深度距离。
+  - 将中心点投影到Realsense深度图上 (或使用整幅对齐的深度帧)，精确获取该中心点的深度距离。
   - 在画面上实时显示物体的类别、置信度以及三维空间距离。
   - 按下 's' 键可以保存一张带有完整标注（检测框+深度）的静态图像。
 
@@ -19,9 +19,22 @@
 import pyrealsense2 as rs
 import numpy as np
 import cv2
+import torch
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
+from ultralytics.utils import ops
 import os
 import time
+import queue
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+# Numba 为可选依赖 (pip install numba)，未安装时测距使用纯NumPy实现
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
 
 # --- 1. 配置参数 ---
 # 图像尺寸
@@ -34,11 +47,29 @@ CONFIDENCE_THRESHOLD = 0.5
 # 模型路径 (请根据您实际的训练输出文件夹修改 'train' 部分)
 MODEL_PATH = os.path.join('runs', 'detect', 'train', 'weights', 'best.pt')
 MODEL_PATH = 'yolov8n.pt'  # 如果没有自定义模型，可以使用预训练模型测试 
+# TensorRT 引擎路径 (首次运行时由 MODEL_PATH 自动导出为 FP16 引擎)
+ENGINE_PATH = os.path.splitext(MODEL_PATH)[0] + '.engine'
+# 推理输入尺寸 (TensorRT 引擎为固定形状，推理时必须与导出尺寸一致)
+INFER_SIZE = 640
+# 预热推理次数：在进入主循环前完成cuDNN算法选择等一次性开销
+WARMUP_RUNS = 3
+# 画面变化阈值：当前帧与上次推理帧的 80x60 灰度缩略图的平均绝对差低于此值时，
+# 认为画面基本静止，直接复用上次的检测结果而跳过推理 (深度仍每帧重新测量)。设为0可关闭
+MOTION_THRESHOLD = 3.0
+# 测距邻域边长：取中心点周围 DEPTH_WINDOW x DEPTH_WINDOW 像素内有效深度的中值
+DEPTH_WINDOW = 5
+# 稀疏深度投影：只把检测框中心点从彩色图投影到深度图，代替每帧对整幅深度图做对齐 (rs.align)。
+# 设为 False 时回退到整幅对齐
+SPARSE_DEPTH_PROJECTION = True
+# 投影时沿视线搜索的深度范围 (单位：米)
+DEPTH_RANGE = (0.1, 10.0)
 # 截图保存路径
 SNAPSHOT_PATH = "snapshots"
+# 显示窗口名称
+WINDOW_NAME = "YOLOv8 Detection with Depth"
 
 class RealsenseCamera:
-    """一个封装了Realsense摄像头所有操作的类，确保稳定运行并提供对齐帧。"""
+    """一个封装了Realsense摄像头所有操作的类，确保稳定运行并提供滤波后的深度帧及坐标投影。"""
     def __init__(self, width=IMG_WIDTH, height=IMG_HEIGHT, fps=FPS):
         self.width = width
         self.height = height
@@ -48,13 +79,37 @@ class RealsenseCamera:
         self.config.enable_stream(rs.stream.depth, self.width, self.height, rs.format.z16, self.fps)
         self.config.enable_stream(rs.stream.color, self.width, self.height, rs.format.bgr8, self.fps)
         self.align = rs.align(rs.stream.color)
+        # 深度后处理滤波链 (SDK内置的SIMD实现)，按Intel推荐顺序：
+        # 降采样 -> 转视差 -> 空间滤波 -> 时间滤波 -> 转回深度 -> 空洞填充
+        self.depth_filters = [
+            rs.decimation_filter(),
+            rs.disparity_transform(True),
+            rs.spatial_filter(),
+            rs.temporal_filter(),
+            rs.disparity_transform(False),
+            rs.hole_filling_filter(),
+        ]
+        self.profile = None
+        self.depth_scale = 0.0
+        # 彩色->深度像素投影所需的内参与外参
+        self.color_intrin = None
+        self.depth_intrin = None
+        self.depth_to_color = None
+        self.color_to_depth = None
 
     def start(self):
         """启动摄像头并进行预热"""
         print("正在启动Realsense摄像头...")
         try:
-            self.pipeline.start(self.config)
-            print("摄像头启动成功！")
+            self.profile = self.pipeline.start(self.config)
+            depth_sensor = self.profile.get_device().first_depth_sensor()
+            self.depth_scale = depth_sensor.get_depth_scale()
+            print(f"摄像头启动成功！深度缩放因子: {self.depth_scale}")
+            depth_profile = self.profile.get_stream(rs.stream.depth).as_video_stream_profile()
+            color_profile = self.profile.get_stream(rs.stream.color).as_video_stream_profile()
+            self.color_intrin = color_profile.get_intrinsics()
+            self.depth_to_color = depth_profile.get_extrinsics_to(color_profile)
+            self.color_to_depth = color_profile.get_extrinsics_to(depth_profile)
             # 等待自动曝光/增益稳定
             for _ in range(30):
                 self.pipeline.wait_for_frames()
@@ -63,26 +118,363 @@ class RealsenseCamera:
             print(f"错误：无法启动Realsense摄像头。{e}")
             return False
 
+    def _wait_filtered_frames(self):
+        """等待一组帧，并对其中的深度帧做一次整幅滤波，填补空洞并抑制噪声"""
+        frames = self.pipeline.wait_for_frames(5000)
+        for depth_filter in self.depth_filters:
+            frames = depth_filter.process(frames).as_frameset()
+        return frames
+
+    def _to_color_image(self, color_frame):
+        # 直接以帧缓冲区构造数组视图，不复制像素数据。
+        # 数组持有缓冲区的引用，帧在队列中被保留期间不会被SDK回收
+        return np.frombuffer(color_frame.get_data(), np.uint8).reshape(self.height, self.width, 3)
+
+    def get_frames(self):
+        """
+        获取彩色图像和经过滤波的深度帧对象。
+        稀疏投影模式下不做整幅对齐，深度帧保持自身(降采样后)的坐标，
+        之后只需用 color_to_depth_pixels 投影检测框中心点；否则回退到 get_aligned_frames。
+        """
+        if not SPARSE_DEPTH_PROJECTION:
+            return self.get_aligned_frames()
+        try:
+            frames = self._wait_filtered_frames()
+            depth_frame = frames.get_depth_frame()
+            color_frame = frames.get_color_frame()
+            if not depth_frame or not color_frame:
+                return None, None
+            if self.depth_intrin is None:
+                # 降采样后的深度内参与原始深度流不同，需从滤波后的帧中获取
+                self.depth_intrin = depth_frame.profile.as_video_stream_profile().get_intrinsics()
+            return self._to_color_image(color_frame), depth_frame
+        except Exception as e:
+            print(f"获取帧时发生错误: {e}")
+            return None, None
+
     def get_aligned_frames(self):
-        """获取对齐后的彩色帧和深度帧对象"""
+        """获取对齐后的彩色帧和(经过滤波的)深度帧对象"""
         try:
-            frames = self.pipeline.wait_for_frames(5000)
+            # 在对齐之前滤波，对齐时深度图会重新映射回彩色图的分辨率和坐标
+            frames = self._wait_filtered_frames()
             aligned_frames = self.align.process(frames)
             depth_frame = aligned_frames.get_depth_frame()
             color_frame = aligned_frames.get_color_frame()
             if not depth_frame or not color_frame:
                 return None, None
-            color_image = np.asanyarray(color_frame.get_data())
-            return color_image, depth_frame
+            return self._to_color_image(color_frame), depth_frame
         except Exception as e:
             print(f"获取帧时发生错误: {e}")
             return None, None
 
+    def color_to_depth_pixels(self, depth_frame, cx, cy):
+        """
+        将彩色图中的像素坐标 (cx, cy) 投影到深度图坐标，返回 (M, 2) 的 int32 (x, y) 数组，
+        投影失败的点为 (-1, -1)。只计算需要的点，代替对整幅深度图做对齐；
+        整幅对齐模式下两者坐标一致，直接返回。
+        """
+        if not SPARSE_DEPTH_PROJECTION:
+            return np.stack([cx, cy], axis=1).astype(np.int32)
+        depth_data = depth_frame.get_data()
+        pixels = np.empty((len(cx), 2), np.int32)
+        for i in range(len(cx)):
+            x, y = rs.rs2_project_color_pixel_to_depth_pixel(
+                depth_data, self.depth_scale, DEPTH_RANGE[0], DEPTH_RANGE[1],
+                self.depth_intrin, self.color_intrin, self.depth_to_color, self.color_to_depth,
+                [float(cx[i]), float(cy[i])])
+            pixels[i] = (round(x), round(y))
+        return pixels
+
     def stop(self):
         """停止摄像头"""
         print("正在关闭摄像头...")
         self.pipeline.stop()
 
+class FrameProducer:
+    """
+    后台采集线程：持续获取帧并放入容量为2的队列，使采集/深度滤波与GPU推理并行。
+    队列满时丢弃最旧的一帧，主线程总是处理最新画面。
+    """
+    def __init__(self, cam, maxsize=2):
+        self.cam = cam
+        self.frames = queue.Queue(maxsize=maxsize)
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """启动采集线程"""
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            color_image, depth_frame = self.cam.get_frames()
+            if color_image is None:
+                continue
+            # 队列已满时先丢弃最旧的一帧
+            if self.frames.full():
+                try:
+                    self.frames.get_nowait()
+                except queue.Empty:
+                    pass
+            self.frames.put((color_image, depth_frame), block=True)
+
+    def get(self, timeout=1.0):
+        """取出一组 (彩色图像, 深度帧)，超时返回 (None, None)"""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
+
+    def stop(self):
+        """通知采集线程退出并等待其结束"""
+        self.stop_event.set()
+        self.thread.join(timeout=6.0)
+
+class DisplayWorker:
+    """
+    显示线程：在独立线程中执行 imshow/waitKey，只保留最新的一帧 (未来得及显示的旧帧直接丢弃)，
+    使推理循环不再等待窗口刷新；截图的JPEG编码与写盘交给单线程线程池完成。
+    """
+    def __init__(self, window_name):
+        self.window_name = window_name
+        self.slot = None
+        self.lock = threading.Lock()
+        self.keys = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.writer = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        """启动显示线程"""
+        self.thread.start()
+
+    def _run(self):
+        # 窗口的创建、刷新和销毁都在同一线程中完成
+        cv2.namedWindow(self.window_name, cv2.WINDOW_AUTOSIZE)
+        while not self.stop_event.is_set():
+            with self.lock:
+                frame, self.slot = self.slot, None
+            if frame is not None:
+                cv2.imshow(self.window_name, frame)
+            key = cv2.waitKey(1) & 0xFF
+            if key != 0xFF:
+                self.keys.put(key)
+        cv2.destroyAllWindows()
+
+    def show(self, frame):
+        """提交一帧待显示的图像，覆盖尚未显示的旧帧"""
+        with self.lock:
+            self.slot = frame
+
+    def poll_key(self):
+        """非阻塞地取出一个按键，没有按键时返回 -1"""
+        try:
+            return self.keys.get_nowait()
+        except queue.Empty:
+            return -1
+
+    def save(self, filename, frame):
+        """在后台线程中编码并保存图像 (调用方之后不应再修改 frame)"""
+        self.writer.submit(self._write, filename, frame)
+
+    @staticmethod
+    def _write(filename, frame):
+        # 在写盘线程中执行，写入完成后才报告结果；cv2.imwrite 失败时只返回 False 而不抛异常
+        try:
+            if cv2.imwrite(filename, frame):
+                print(f"截图已保存至: {filename}")
+            else:
+                print(f"错误: 截图保存失败 (无法写入文件): {filename}")
+        except Exception as e:
+            print(f"错误: 截图保存失败: {filename}。{e}")
+
+    def stop(self):
+        """关闭窗口并等待所有截图写入完成"""
+        self.stop_event.set()
+        self.thread.join(timeout=1.0)
+        self.writer.shutdown(wait=True)
+
+def build_class_styles(names):
+    """
+    在模型加载后预先生成类别名称列表和每个类别的BGR颜色，
+    绘制时按类别ID直接查表，避免每帧重复查找和计算。
+    """
+    class_names = list(names.values())
+    # 在HSV空间按类别均匀取色 (OpenCV的H范围为0~179)，再一次性转换为BGR
+    hsv = np.array([[(h * 40 % 180, 200, 200) for h in range(len(class_names))]], np.uint8)
+    bgr = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0]
+    class_colors = [tuple(int(c) for c in color) for color in bgr]
+    return class_names, class_colors
+
+def render_sprite(text, color, height):
+    """把一段文字渲染成黑底的小图块 (仅在启动时调用)"""
+    (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    sprite = np.zeros((height, w + 4, 3), np.uint8)
+    cv2.putText(sprite, text, (2, height - baseline - 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    return sprite
+
+def build_label_sprites(class_names, class_colors):
+    """
+    预先渲染标签图块：每个类别名称一块 (类别颜色)，置信度 0.00~1.00 共101块 (白色)。
+    绘制时只需把图块拷贝到画面上，不再每帧调用 putText 逐笔光栅化字形。
+    """
+    (_, h), baseline = cv2.getTextSize("0123456789Agjy", cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
+    height = h + baseline + 4
+    name_sprites = [render_sprite(name, color, height)
+                    for name, color in zip(class_names, class_colors)]
+    conf_sprites = [render_sprite(" %.2f" % (i / 100), (255, 255, 255), height) for i in range(101)]
+    return name_sprites, conf_sprites
+
+def blit_sprite(image, sprite, x, y):
+    """将图块的左下角对齐到 (x, y) 拷贝到画面上，超出画面的部分被裁掉；返回图块右边缘的x坐标"""
+    h, w = sprite.shape[:2]
+    img_h, img_w = image.shape[:2]
+    # 框贴近画面顶部时，把标签放到框内
+    top = max(y - h, 0)
+    left, right = max(x, 0), min(x + w, img_w)
+    bottom = min(top + h, img_h)
+    if left < right and top < bottom:
+        image[top:bottom, left:right] = sprite[:bottom - top, left - x:right - x]
+    return x + w
+
+def draw_label(image, x, y, name_sprite, conf_sprites, conf):
+    """在 (x, y) 上方绘制 '类别 置信度' 标签"""
+    x = blit_sprite(image, name_sprite, x, y)
+    blit_sprite(image, conf_sprites[min(int(conf * 100 + 0.5), 100)], x, y)
+
+def sample_depths(depth_image, cx, cy, depth_scale, window=DEPTH_WINDOW):
+    """
+    一次性获取所有中心点的深度 (单位：米)。
+    对每个中心点取 window x window 邻域内非零深度的中值，避免单个像素缺失深度(为0)
+    导致有效检测被丢弃；邻域内全部为0时返回0。
+    depth_image 为 uint16 深度图，cx/cy 为中心点坐标数组。
+    """
+    h, w = depth_image.shape
+    offsets = np.arange(window) - window // 2
+    # (M, window) 的行/列索引，越界部分截断到图像边缘
+    ys = np.clip(np.add.outer(cy, offsets), 0, h - 1)
+    xs = np.clip(np.add.outer(cx, offsets), 0, w - 1)
+    # 一次索引取出所有邻域 -> (M, window*window)
+    patches = depth_image[ys[:, :, None], xs[:, None, :]].reshape(len(cx), -1).astype(np.float32)
+    patches[patches == 0] = np.nan
+    with warnings.catch_warnings():
+        # 整个邻域都缺失深度时 nanmedian 会发出警告并返回 NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        medians = np.nanmedian(patches, axis=1)
+    return np.nan_to_num(medians, nan=0.0) * depth_scale
+
+class InputPreprocessor:
+    """
+    固定尺寸输入的推理预处理。
+    预先分配页锁定(pinned)内存和GPU上的输入张量并每帧复用，在原地完成
+    letterbox、BGR->RGB、HWC->CHW 和归一化，代替 ultralytics 每帧重新分配张量的Python预处理。
+    """
+    def __init__(self, height, width, imgsz, device, half):
+        self.imgsz = imgsz
+        self.device = torch.device(device)
+        # 与 ultralytics 的 letterbox 一致：等比缩放后居中，四周填充灰色(114)
+        gain = min(imgsz / height, imgsz / width)
+        self.new_h, self.new_w = round(height * gain), round(width * gain)
+        self.top = (imgsz - self.new_h) // 2
+        self.left = (imgsz - self.new_w) // 2
+        use_cuda = self.device.type == 'cuda'
+        self.cpu_buffer = torch.full((imgsz, imgsz, 3), 114, dtype=torch.uint8, pin_memory=use_cuda)
+        # 与 cpu_buffer 共享内存的numpy视图，每帧只需把图像写入中间区域
+        self.cpu_view = self.cpu_buffer.numpy()
+        self.gpu_buffer = torch.empty((imgsz, imgsz, 3), dtype=torch.uint8, device=self.device)
+        dtype = torch.float16 if half else torch.float32
+        self.input = torch.empty((1, 3, imgsz, imgsz), dtype=dtype, device=self.device)
+
+    def __call__(self, image):
+        """将BGR uint8图像写入复用的输入张量并返回该张量"""
+        if image.shape[:2] != (self.new_h, self.new_w):
+            image = cv2.resize(image, (self.new_w, self.new_h), interpolation=cv2.INTER_LINEAR)
+        self.cpu_view[self.top:self.top + self.new_h, self.left:self.left + self.new_w] = image
+        self.gpu_buffer.copy_(self.cpu_buffer, non_blocking=True)
+        # 逐通道拷贝完成 BGR->RGB 与 HWC->CHW，copy_ 同时完成 uint8 到浮点的转换
+        for c in range(3):
+            self.input[0, c].copy_(self.gpu_buffer[:, :, 2 - c])
+        return self.input.mul_(1.0 / 255.0)
+
+def predict(predictor, preprocess, image, conf):
+    """
+    绕过 ultralytics 的Python预处理，直接调用推理后端并做NMS，
+    返回与 model(...) 相同格式的结果列表。
+    """
+    args = predictor.args
+    preds = predictor.model(preprocess(image))
+    det = ops.non_max_suppression(preds, conf, args.iou, classes=args.classes,
+                                  agnostic=args.agnostic_nms, max_det=args.max_det)[0]
+    det[:, :4] = ops.scale_boxes((preprocess.imgsz, preprocess.imgsz), det[:, :4], image.shape)
+    return [Results(image, path='', names=predictor.model.names, boxes=det[:, :6])]
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def aggregate_depth(depth, centers, scale, half, out):
+        """
+        Numba编译的测距内核：对每个深度图坐标 (x, y)，
+        取 (2*half+1) x (2*half+1) 邻域内非零深度的中值乘以 scale 写入 out；
+        各中心点在多个CPU核心上并行处理。
+        """
+        h, w = depth.shape
+        size = 2 * half + 1
+        for i in prange(centers.shape[0]):
+            cx = centers[i, 0]
+            cy = centers[i, 1]
+            vals = np.empty(size * size, np.float32)
+            n = 0
+            for dy in range(-half, half + 1):
+                y = min(max(cy + dy, 0), h - 1)
+                for dx in range(-half, half + 1):
+                    x = min(max(cx + dx, 0), w - 1)
+                    v = depth[y, x]
+                    if v != 0:
+                        vals[n] = v
+                        n += 1
+            out[i] = np.median(vals[:n]) * scale if n > 0 else 0.0
+else:
+    aggregate_depth = None
+
+def measure_depths(depth_image, centers, depth_scale):
+    """
+    获取所有中心点 (深度图坐标，(M, 2) int32) 的距离 (单位：米)，
+    优先使用Numba内核，否则回退到 sample_depths；坐标为负(投影失败)的点距离为0。
+    """
+    if aggregate_depth is not None:
+        dists = np.empty(len(centers), np.float32)
+        aggregate_depth(depth_image, centers, depth_scale, DEPTH_WINDOW // 2, dists)
+    else:
+        dists = sample_depths(depth_image, centers[:, 0], centers[:, 1], depth_scale)
+    dists[centers[:, 0] < 0] = 0.0
+    return dists
+
+def frame_thumbnail(image):
+    """生成用于比较画面变化的 80x60 灰度缩略图 (int16，便于直接相减)"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (80, 60), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+def load_model():
+    """
+    加载YOLOv8模型，优先使用TensorRT FP16引擎。
+    引擎不存在或比 MODEL_PATH 旧时从 MODEL_PATH 导出 (耗时数分钟)；导出失败则回退到PyTorch模型。
+    """
+    # 权重在引擎导出之后被重新训练或替换过 (修改时间更新) 时，旧引擎已过期，需要重新导出
+    engine_stale = (os.path.exists(ENGINE_PATH) and os.path.exists(MODEL_PATH)
+                    and os.path.getmtime(MODEL_PATH) > os.path.getmtime(ENGINE_PATH))
+    if engine_stale or not os.path.exists(ENGINE_PATH):
+        if engine_stale:
+            print(f"模型权重 '{MODEL_PATH}' 比TensorRT引擎新，正在重新导出 FP16 引擎...")
+        else:
+            print(f"未找到TensorRT引擎，正在从 '{MODEL_PATH}' 导出 FP16 引擎 (仅首次运行需要)...")
+        try:
+            YOLO(MODEL_PATH).export(format="engine", imgsz=INFER_SIZE, half=True,
+                                    dynamic=False, batch=1, device=0)
+        except Exception as e:
+            print(f"警告: TensorRT引擎导出失败，将使用PyTorch模型推理。{e}")
+            return YOLO(MODEL_PATH)
+    print(f"正在加载TensorRT引擎: {ENGINE_PATH}")
+    return YOLO(ENGINE_PATH, task='detect')
+
 def main():
     # --- 2. 加载模型与准备文件夹 ---
     print(f"正在加载自定义模型: {MODEL_PATH}")
@@ -90,9 +482,25 @@ def main():
         print(f"错误: 在路径 '{MODEL_PATH}' 下未找到模型文件。")
         return
     try:
-        model = YOLO(MODEL_PATH)
+        model = load_model()
         print("模型加载成功！")
         print(f"模型可识别的类别: {model.names}")
+        class_names, class_colors = build_class_styles(model.names)
+        name_sprites, conf_sprites = build_label_sprites(class_names, class_colors)
+        # 输入尺寸固定，让cuDNN为每个卷积自动选择最快的算法
+        torch.backends.cudnn.benchmark = True
+        dummy = np.zeros((IMG_HEIGHT, IMG_WIDTH, 3), np.uint8)
+        # 先用一帧空白图像走一遍标准推理流程，初始化 model.predictor 及其推理后端
+        model(dummy, conf=CONFIDENCE_THRESHOLD, imgsz=INFER_SIZE, verbose=False)
+        predictor = model.predictor
+        preprocess = InputPreprocessor(IMG_HEIGHT, IMG_WIDTH, INFER_SIZE,
+                                       predictor.device, predictor.model.fp16)
+        # 预热实际使用的推理路径，使第一帧的延迟即为稳定状态的延迟
+        print("正在预热模型...")
+        for _ in range(WARMUP_RUNS):
+            predict(predictor, preprocess, dummy, CONFIDENCE_THRESHOLD)
+        # 提前编译测距内核，避免第一帧承担JIT编译开销
+        measure_depths(np.zeros((IMG_HEIGHT, IMG_WIDTH), np.uint16), np.zeros((1, 2), np.int32), 0.001)
     except Exception as e:
         print(f"错误: 加载模型失败。{e}")
         return
@@ -100,63 +508,84 @@ def main():
     if not os.path.exists(SNAPSHOT_PATH):
         os.makedirs(SNAPSHOT_PATH)
 
+    # 采集线程与推理线程已并行，限制OpenCV内部线程数以避免CPU过度订阅
+    cv2.setNumThreads(1)
+
     # --- 3. 启动摄像头 ---
     cam = RealsenseCamera()
     if not cam.start():
         return
+    producer = FrameProducer(cam)
+    producer.start()
+    display = DisplayWorker(WINDOW_NAME)
+    display.start()
 
     # --- 4. 主循环：实时检测与测距 ---
     print("\n实时检测与测距已启动。")
     print("  - 按 's' 键保存截图。")
     print("  - 按 'q' 键退出。")
+    # 上次推理时画面的缩略图
+    last_thumbnail = None
     try:
         while True:
-            # 获取对齐的帧
-            color_image, depth_frame = cam.get_aligned_frames()
+            # 从采集线程获取最新的彩色图像和深度帧
+            color_image, depth_frame = producer.get()
             if color_image is None:
                 continue
 
-            # 使用YOLOv8进行推理
-            results = model(color_image, conf=CONFIDENCE_THRESHOLD, verbose=False)
+            # 画面与上次推理时几乎相同，则复用上次的检测结果
+            thumbnail = frame_thumbnail(color_image)
+            if last_thumbnail is None or np.abs(thumbnail - last_thumbnail).mean() >= MOTION_THRESHOLD:
+                # 使用YOLOv8进行推理 (复用预分配的输入张量)
+                results = predict(predictor, preprocess, color_image, CONFIDENCE_THRESHOLD)
+
+                # 一次性将本帧所有检测框的坐标、置信度和类别拷回CPU，
+                # 避免逐框访问张量时每个属性都触发一次GPU同步
+                b = results[0].boxes
+                xyxy = b.xyxy.cpu().numpy().astype(np.int32)
+                confs = b.conf.cpu().numpy()
+                cls_ids = b.cls.cpu().numpy().astype(np.int32)
+                last_thumbnail = thumbnail
+
+            # 计算所有边界框的中心点
+            cxs = (xyxy[:, 0] + xyxy[:, 2]) // 2
+            cys = (xyxy[:, 1] + xyxy[:, 3]) // 2
+
+            # --- [核心功能] 一次性获取所有中心点的深度 (单位：米) ---
+            if len(xyxy):
+                # 深度帧的零拷贝 uint16 视图
+                depth_image = np.asanyarray(depth_frame.get_data())
+                # 只把检测框中心点投影到深度图上，无需整幅对齐
+                centers = cam.color_to_depth_pixels(depth_frame, cxs, cys)
+                dists = measure_depths(depth_image, centers, cam.depth_scale)
 
             # 遍历检测结果
-            for box in results[0].boxes:
-                # 获取边界框坐标
-                x1, y1, x2, y2 = map(int, box.xyxy[0])
-                # 获取置信度和类别
-                conf = box.conf[0]
-                cls_id = int(box.cls[0])
-                class_name = model.names[cls_id]
-
-                # --- [核心功能] 计算中心点并获取深度 ---
-                # 计算边界框的中心点
-                cx, cy = int((x1 + x2) / 2), int((y1 + y2) / 2)
-
-                # 从深度帧中获取该点的距离 (单位：米)
-                # get_distance会自动处理深度比例因子
-                distance = depth_frame.get_distance(cx, cy)
-                
+            for i in range(len(xyxy)):
+                x1, y1, x2, y2 = xyxy[i].tolist()
+                cx, cy = int(cxs[i]), int(cys[i])
+                conf = confs[i]
+                cls_id = cls_ids[i]
+                distance = float(dists[i])
+
                 # 如果距离有效 (大于0)
                 if distance > 0:
                     # --- 可视化 ---
+                    color = class_colors[cls_id]
                     # 绘制边界框
-                    cv2.rectangle(color_image, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                    cv2.rectangle(color_image, (x1, y1), (x2, y2), color, 2)
                     # 绘制中心点
                     cv2.circle(color_image, (cx, cy), 5, (0, 0, 255), -1)
-                    # 准备标签和距离文本
-                    label = f"{class_name} {conf:.2f}"
-                    distance_text = f"{distance:.2f}m"
-                    # 显示类别标签
-                    cv2.putText(color_image, label, (x1, y1 - 10), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                    # 显示类别标签 (使用预先渲染的图块)
+                    draw_label(color_image, x1, y1, name_sprites[cls_id], conf_sprites, conf)
                     # 显示距离文本
+                    distance_text = "%.2fm" % distance
                     cv2.putText(color_image, distance_text, (cx + 10, cy), 
                                 cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
 
 
-            # 显示结果图像
-            cv2.imshow("YOLOv8 Detection with Depth", color_image)
-            key = cv2.waitKey(1) & 0xFF
+            # 交给显示线程显示结果图像
+            display.show(color_image)
+            key = display.poll_key()
 
             # 按 'q' 键退出
             if key == ord('q'):
@@ -165,14 +594,15 @@ def main():
             elif key == ord('s'):
                 timestamp = time.strftime("%Y%m%d-%H%M%S")
                 snapshot_file = os.path.join(SNAPSHOT_PATH, f"snapshot_{timestamp}.jpg")
-                cv2.imwrite(snapshot_file, color_image)
-                print(f"截图已保存至: {snapshot_file}")
+                # 保存结果由写盘线程在写入完成后打印
+                display.save(snapshot_file, color_image)
 
 
     finally:
         # --- 5. 清理资源 ---
+        producer.stop()
+        display.stop()
         cam.stop()
-        cv2.destroyAllWindows()
         print("程序已成功关闭。")
 
 if __name__ == '__main__':